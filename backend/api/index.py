@@ -1,28 +1,1061 @@
+import base64
+import bisect
+import hashlib
+import io
 import json
+import math
 import os
+import select
+import threading
+import time
 import psycopg2
-from psycopg2.extras import RealDictCursor
-from typing import Dict, Any
+import psycopg2.extensions
+import psycopg2.extras
+from psycopg2 import sql
+from psycopg2.extras import RealDictCursor, execute_values
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Dict, Any, List, Optional, Set, Tuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+DEFAULT_PROJECT_ID = int(os.environ.get('DEFAULT_PROJECT_ID', '1'))
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+DB_POOL_PING_INTERVAL = float(os.environ.get('DB_POOL_PING_INTERVAL', '30'))
+
+_pool: List[Tuple[Any, float]] = []
+_pool_lock = threading.Lock()
+_pool_stats: Dict[str, int] = {'hits': 0, 'misses': 0, 'reconnects': 0, 'discarded': 0}
+
+def _close_quietly(conn) -> None:
+    """Закрывает подключение, игнорируя ошибки"""
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+def _is_connection_healthy(conn, last_used: float) -> bool:
+    """Проверяет, что подключение из пула еще живо"""
+    if conn.closed:
+        return False
+    if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+        return False
+    if time.monotonic() - last_used < DB_POOL_PING_INTERVAL:
+        return True
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
 
 def get_db_connection():
-    """Создает подключение к базе данных"""
+    """Берет подключение из пула теплого инстанса или создает новое"""
+    with _pool_lock:
+        while _pool:
+            conn, last_used = _pool.pop()
+            if _is_connection_healthy(conn, last_used):
+                _pool_stats['hits'] += 1
+                return conn
+            _pool_stats['reconnects'] += 1
+            _close_quietly(conn)
+        _pool_stats['misses'] += 1
     return psycopg2.connect(os.environ['DATABASE_URL'])
 
+def release_db_connection(conn, broken: bool = False) -> None:
+    """Возвращает подключение в пул или закрывает его"""
+    if not broken and not conn.closed:
+        try:
+            if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except psycopg2.Error:
+            broken = True
+    with _pool_lock:
+        if not broken and not conn.closed and len(_pool) < DB_POOL_MAX_SIZE:
+            _pool.append((conn, time.monotonic()))
+            return
+        _pool_stats['discarded'] += 1
+    _close_quietly(conn)
+
+def get_pool_stats() -> Dict[str, int]:
+    """Счетчики пула подключений"""
+    with _pool_lock:
+        return dict(_pool_stats, idle=len(_pool), max_size=DB_POOL_MAX_SIZE)
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '').lower() in ('1', 'true', 'yes')
+METRICS_BUCKETS_MS = (0.5, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+METRICS_MAX_KEYS = 128
+
+_instance_started_at = time.time()
+_invocations = 0
+_request_state = threading.local()
+_metrics_lock = threading.Lock()
+_histograms: Dict[str, Dict[str, Dict[str, Any]]] = {}
+
+def record_phase(phase: str, seconds: float) -> None:
+    """Добавляет длительность фазы к таймингам текущего запроса"""
+    timings = getattr(_request_state, 'timings', None)
+    if timings is not None:
+        timings[phase] = timings.get(phase, 0.0) + seconds
+
+class _TimingMixin:
+    """Замеряет время execute и fetch* любого курсора psycopg2"""
+    
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            record_phase('execute', time.perf_counter() - started)
+    
+    def fetchone(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            record_phase('fetch', time.perf_counter() - started)
+    
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        try:
+            return super().fetchmany(size)
+        finally:
+            record_phase('fetch', time.perf_counter() - started)
+    
+    def fetchall(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            record_phase('fetch', time.perf_counter() - started)
+
+class TimedCursor(_TimingMixin, RealDictCursor):
+    """RealDictCursor с замером времени"""
+
+class TimedTupleCursor(_TimingMixin, psycopg2.extensions.cursor):
+    """Обычный кортежный курсор с замером времени"""
+
+JSON_MODE = os.environ.get('JSON_MODE', 'python')
+STRINGIFIED_TYPE_OIDS = {1082, 1083, 1114, 1184, 1266, 1700}
+
+if orjson is not None:
+    psycopg2.extras.register_default_json(loads=orjson.loads, globally=True)
+    psycopg2.extras.register_default_jsonb(loads=orjson.loads, globally=True)
+
+_column_plans: Dict[Tuple[Tuple[str, int], ...], Callable[[Tuple[Any, ...]], Dict[str, Any]]] = {}
+
+def column_plan(description) -> Callable[[Tuple[Any, ...]], Dict[str, Any]]:
+    """Кэшированный конвертер строки-кортежа в dict для данного набора колонок"""
+    signature = tuple((column.name, column.type_code) for column in description)
+    plan = _column_plans.get(signature)
+    if plan is not None:
+        return plan
+    
+    names = tuple(name for name, _ in signature)
+    stringified = tuple(index for index, (_, type_code) in enumerate(signature) if type_code in STRINGIFIED_TYPE_OIDS)
+    
+    if not stringified:
+        def plan(row: Tuple[Any, ...]) -> Dict[str, Any]:
+            return dict(zip(names, row))
+    else:
+        def plan(row: Tuple[Any, ...]) -> Dict[str, Any]:
+            values = list(row)
+            for index in stringified:
+                if values[index] is not None:
+                    values[index] = str(values[index])
+            return dict(zip(names, values))
+    
+    _column_plans[signature] = plan
+    return plan
+
+def query_records(cur, query: str, args: Any = None) -> List[Dict[str, Any]]:
+    """Выполняет запрос кортежным курсором; даты и numeric сразу приводятся к строкам"""
+    with cur.connection.cursor(cursor_factory=TimedTupleCursor) as tuple_cur:
+        tuple_cur.execute(query, args)
+        plan = column_plan(tuple_cur.description)
+        rows = tuple_cur.fetchall()
+    return [plan(row) for row in rows]
+
+def query_json(cur, query: str, args: Any = None) -> str:
+    """
+    JSON-массив результатов запроса: собирается в Python или самим Postgres (JSON_MODE=postgres)
+    В режиме postgres даты отдаются в ISO 8601 с разделителем T
+    """
+    if JSON_MODE == 'postgres':
+        cur.execute(f"SELECT COALESCE(json_agg(r), '[]'::json)::text AS body FROM ({query}) r", args)
+        return cur.fetchone()['body']
+    return serialize(query_records(cur, query, args))
+
+def serialize(data: Any) -> str:
+    """Сериализует тело ответа в JSON (orjson, если установлен) с замером времени"""
+    started = time.perf_counter()
+    try:
+        if orjson is not None:
+            return orjson.dumps(data, default=str, option=orjson.OPT_PASSTHROUGH_DATETIME).decode('utf-8')
+        return json.dumps(data, default=str, ensure_ascii=False, separators=(',', ':'))
+    finally:
+        record_phase('serialize', time.perf_counter() - started)
+
+def observe_request(key: str, timings: Dict[str, float]) -> None:
+    """Записывает тайминги запроса в гистограммы по ключу 'METHOD action'"""
+    with _metrics_lock:
+        if key not in _histograms and len(_histograms) >= METRICS_MAX_KEYS:
+            key = 'other'
+        phases = _histograms.setdefault(key, {})
+        for phase, seconds in timings.items():
+            histogram = phases.get(phase)
+            if histogram is None:
+                histogram = phases[phase] = {'count': 0, 'sum_ms': 0.0, 'max_ms': 0.0, 'buckets': [0] * (len(METRICS_BUCKETS_MS) + 1)}
+            duration_ms = seconds * 1000
+            histogram['count'] += 1
+            histogram['sum_ms'] += duration_ms
+            histogram['max_ms'] = max(histogram['max_ms'], duration_ms)
+            histogram['buckets'][bisect.bisect_left(METRICS_BUCKETS_MS, duration_ms)] += 1
+
+def server_timing_header(timings: Dict[str, float], cold_start: bool) -> str:
+    """Значение заголовка Server-Timing"""
+    parts = [f'{phase};dur={seconds * 1000:.3f}' for phase, seconds in timings.items()]
+    if cold_start:
+        parts.append('cold')
+    return ', '.join(parts)
+
+def get_metrics() -> Dict[str, Any]:
+    """Снимок гистограмм и счетчиков инстанса"""
+    labels = [f'le_{bound}' for bound in METRICS_BUCKETS_MS] + ['le_inf']
+    with _metrics_lock:
+        actions = {
+            key: {
+                phase: dict(histogram, buckets=dict(zip(labels, histogram['buckets'])))
+                for phase, histogram in phases.items()
+            }
+            for key, phases in _histograms.items()
+        }
+    return {
+        'instance': {'started_at': _instance_started_at, 'invocations': _invocations},
+        'actions': actions,
+        'pool': get_pool_stats(),
+        'cache': get_cache_stats()
+    }
+
+RESPONSE_CACHE_TTL = float(os.environ.get('RESPONSE_CACHE_TTL', '30'))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', '256'))
+CACHEABLE_ACTIONS = ('vision', 'okrs', 'stories', 'comments', 'arch-elements', 'bootstrap')
+WRITE_INVALIDATES: Dict[str, Tuple[str, ...]] = {
+    'vision': ('vision', 'bootstrap'),
+    'okrs': ('okrs', 'bootstrap'),
+    'stories': ('stories', 'bootstrap'),
+    'comments': ('comments',),
+    'arch-elements': ('arch-elements', 'bootstrap')
+}
+
+_response_cache: 'OrderedDict[Tuple[Any, ...], Tuple[float, str, str]]' = OrderedDict()
+_cache_lock = threading.Lock()
+_cache_stats: Dict[str, int] = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'invalidations': 0}
+
+def make_cache_key(action: str, project_id: int, params: Dict[str, Any]) -> Tuple[Any, ...]:
+    """Ключ кэша: действие, проект и остальные параметры запроса"""
+    extra = tuple(sorted((k, str(v)) for k, v in params.items() if k not in ('action', 'project_id')))
+    return (action, project_id, extra)
+
+def cache_get(key: Tuple[Any, ...]) -> Optional[Tuple[str, str]]:
+    """Возвращает сериализованный ответ и его ETag из кэша, если он не устарел"""
+    with _cache_lock:
+        entry = _response_cache.get(key)
+        if entry is None:
+            _cache_stats['misses'] += 1
+            return None
+        expires_at, body, etag = entry
+        if expires_at <= time.monotonic():
+            del _response_cache[key]
+            _cache_stats['expirations'] += 1
+            _cache_stats['misses'] += 1
+            return None
+        _response_cache.move_to_end(key)
+        _cache_stats['hits'] += 1
+        return body, etag
+
+def cache_put(key: Tuple[Any, ...], body: str, etag: str) -> None:
+    """Сохраняет сериализованный ответ, вытесняя самые старые записи"""
+    with _cache_lock:
+        _response_cache[key] = (time.monotonic() + RESPONSE_CACHE_TTL, body, etag)
+        _response_cache.move_to_end(key)
+        while len(_response_cache) > RESPONSE_CACHE_MAX_ENTRIES:
+            _response_cache.popitem(last=False)
+            _cache_stats['evictions'] += 1
+
+def _key_mentions(extra: Tuple[Tuple[str, str], ...], name: str, value: Any) -> bool:
+    """Параметры ключа содержат name=value или value в списке {name}s (id сравниваются как числа)"""
+    key_params = dict(extra)
+    try:
+        target = int(value)
+    except (TypeError, ValueError):
+        return key_params.get(name) == str(value)
+    for raw in [key_params.get(name, '')] + key_params.get(f'{name}s', '').split(','):
+        try:
+            if int(raw) == target:
+                return True
+        except ValueError:
+            continue
+    return False
+
+def invalidate_cache(project_id: int, actions: Tuple[str, ...], match: Optional[Dict[str, Any]] = None) -> None:
+    """Сбрасывает записи кэша проекта для указанных действий"""
+    with _cache_lock:
+        stale = [
+            key for key in _response_cache
+            if key[0] in actions and key[1] == project_id
+            and all(_key_mentions(key[2], name, value) for name, value in (match or {}).items())
+        ]
+        for key in stale:
+            del _response_cache[key]
+        _cache_stats['invalidations'] += len(stale)
+
+def get_cache_stats() -> Dict[str, int]:
+    """Счетчики кэша ответов"""
+    with _cache_lock:
+        return dict(_cache_stats, size=len(_response_cache), max_entries=RESPONSE_CACHE_MAX_ENTRIES)
+
+def update_element_positions(cur, project_id: int, items: List[Dict[str, Any]], last_write_wins: bool) -> List[Dict[str, Any]]:
+    """Обновляет позиции пакета элементов одним запросом (строки по возрастанию id, координаты округляет Postgres)"""
+    latest: Dict[int, Dict[str, Any]] = {}
+    for item in items:
+        element_id = int(item['id'])
+        previous = latest.get(element_id)
+        if previous is None or (item.get('client_ts') or 0) >= (previous.get('client_ts') or 0):
+            latest[element_id] = item
+    
+    values = [
+        (element_id, float(item['x']), float(item['y']), item.get('client_ts'))
+        for element_id, item in sorted(latest.items())
+    ]
+    stale_filter = '''
+        AND (v.client_ts IS NULL OR ae.position_client_ts IS NULL OR v.client_ts > ae.position_client_ts)
+    ''' if last_write_wins else ''
+    
+    query = sql.SQL('''
+        UPDATE architecture_elements AS ae
+        SET x_position = v.x, y_position = v.y,
+            position_client_ts = COALESCE(v.client_ts, ae.position_client_ts),
+            updated_at = CURRENT_TIMESTAMP
+        FROM (VALUES %s) AS v(id, x, y, client_ts)
+        WHERE ae.id = v.id AND ae.project_id = {project_id}
+    ''' + stale_filter + '''
+        RETURNING ae.id, ae.element_type as type, ae.name, ae.x_position as x, ae.y_position as y
+    ''').format(project_id=sql.Literal(project_id))
+    
+    return execute_values(cur, query, values,
+        template="(%s::integer, %s::integer, %s::integer, to_timestamp(%s::double precision / 1000) AT TIME ZONE 'UTC')",
+        page_size=len(values), fetch=True)
+
+BOOTSTRAP_SECTIONS: Dict[str, str] = {
+    'vision': '''
+        SELECT COALESCE((
+            SELECT json_build_object(
+                'vision', vision, 'target_audience', target_audience,
+                'value_proposition', value_proposition, 'timeline', timeline,
+                'budget', budget, 'success_metric', success_metric)
+            FROM projects
+            WHERE id = %(project_id)s
+        ), '{}'::json)
+    ''',
+    'okrs': '''
+        SELECT COALESCE(json_agg(json_build_object(
+            'id', id, 'objective', objective, 'key_results', key_results,
+            'created_at', created_at::text, 'updated_at', updated_at::text
+        ) ORDER BY created_at ASC), '[]'::json)
+        FROM project_okrs
+        WHERE project_id = %(project_id)s
+    ''',
+    'stories': '''
+        SELECT COALESCE(json_agg(json_build_object(
+            'id', id, 'role', role, 'action', action, 'benefit', benefit,
+            'priority', priority, 'epic', epic,
+            'created_at', created_at::text, 'updated_at', updated_at::text
+        ) ORDER BY created_at DESC, id DESC), '[]'::json)
+        FROM user_stories
+        WHERE project_id = %(project_id)s
+    ''',
+    'arch_elements': '''
+        SELECT COALESCE(json_agg(json_build_object(
+            'id', id, 'type', element_type, 'name', name, 'x', x_position, 'y', y_position
+        ) ORDER BY id ASC), '[]'::json)
+        FROM architecture_elements
+        WHERE project_id = %(project_id)s AND canvas_type = 'context'
+    '''
+}
+
+def build_bootstrap_query(fields: List[str]) -> str:
+    """Собирает один запрос, который отдает выбранные разделы готовым JSON"""
+    parts = ", ".join(f"'{name}', ({BOOTSTRAP_SECTIONS[name]})" for name in fields)
+    return f'SELECT json_build_object({parts})::text AS bootstrap'
+
+VERSION_SOURCES: Dict[str, str] = {
+    'vision': '''
+        SELECT concat_ws(':', id, xmin) FROM projects WHERE id = %(project_id)s
+    ''',
+    'okrs': '''
+        SELECT concat_ws(':', count(*), max(id), sum(hashtext(xmin::text)))
+        FROM project_okrs
+        WHERE project_id = %(project_id)s
+    ''',
+    'stories': '''
+        SELECT concat_ws(':', count(*), max(id), sum(hashtext(xmin::text)))
+        FROM user_stories
+        WHERE project_id = %(project_id)s
+    ''',
+    'comments': '''
+        SELECT concat_ws(':', count(*), max(id), max(created_at))
+        FROM comments
+        WHERE story_id = %(story_id)s
+          AND EXISTS (SELECT 1 FROM user_stories s WHERE s.id = comments.story_id AND s.project_id = %(project_id)s)
+    ''',
+    'comments_batch': '''
+        SELECT concat_ws(':', count(*), max(id), max(created_at))
+        FROM comments
+        WHERE story_id = ANY(%(story_ids)s)
+          AND EXISTS (SELECT 1 FROM user_stories s WHERE s.id = comments.story_id AND s.project_id = %(project_id)s)
+    ''',
+    'arch_elements': '''
+        SELECT concat_ws(':', count(*), max(id), sum(hashtext(xmin::text)))
+        FROM architecture_elements
+        WHERE project_id = %(project_id)s AND canvas_type = 'context'
+    '''
+}
+
+def parse_bootstrap_fields(params: Dict[str, Any]) -> Tuple[List[str], List[str]]:
+    """Разбирает ?fields= для bootstrap: выбранные и неизвестные разделы"""
+    requested = params.get('fields')
+    if not requested:
+        return list(BOOTSTRAP_SECTIONS), []
+    selected = {field.strip().replace('-', '_') for field in requested.split(',') if field.strip()}
+    unknown = sorted(selected - set(BOOTSTRAP_SECTIONS))
+    return [field for field in BOOTSTRAP_SECTIONS if field in selected], unknown
+
+def build_version_query(action: str, project_id: int, params: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+    """Собирает дешевый агрегатный запрос версии данных для ETag"""
+    args: Dict[str, Any] = {'project_id': project_id}
+    if action == 'bootstrap':
+        sections, unknown = parse_bootstrap_fields(params)
+        if unknown:
+            raise ValueError(f'unknown fields: {", ".join(unknown)}')
+        if not sections:
+            raise ValueError('fields must not be empty')
+    elif action == 'comments' and 'story_ids' in params:
+        sections = ['comments_batch']
+        args['story_ids'] = parse_story_ids(params)
+    else:
+        sections = [action.replace('-', '_')]
+        args['story_id'] = params.get('story_id')
+    parts = ', '.join(f'({VERSION_SOURCES[section]})' for section in sections)
+    return f"SELECT concat_ws('|', {parts}) AS version", args
+
+def make_etag(cache_key: Tuple[Any, ...], version: Optional[str]) -> str:
+    """Строгий ETag из ключа запроса и версии строк"""
+    digest = hashlib.sha1(repr((cache_key, version)).encode('utf-8')).hexdigest()
+    return f'"{digest}"'
+
+def get_header(event: Dict[str, Any], name: str) -> Optional[str]:
+    """Возвращает заголовок запроса без учета регистра"""
+    lowered = name.lower()
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == lowered:
+            return value
+    return None
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Проверяет If-None-Match против текущего ETag"""
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(',')]
+    return '*' in candidates or etag in candidates
+
+def read_headers(etag: str, cache_status: str) -> Dict[str, str]:
+    """Заголовки ответа для кэшируемых GET-запросов"""
+    return {
+        'Content-Type': 'application/json',
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Expose-Headers': 'ETag, X-Cache',
+        'Cache-Control': 'no-cache',
+        'ETag': etag,
+        'X-Cache': cache_status
+    }
+
+def not_modified_response(etag: str, cache_status: str) -> Dict[str, Any]:
+    """Ответ 304 без тела"""
+    headers = read_headers(etag, cache_status)
+    del headers['Content-Type']
+    return {
+        'statusCode': 304,
+        'headers': headers,
+        'body': '',
+        'isBase64Encoded': False
+    }
+
+PAGE_DEFAULT_LIMIT = 50
+PAGE_MAX_LIMIT = 200
+
+def is_paginated(params: Dict[str, Any]) -> bool:
+    """Клиент запросил постраничную выдачу"""
+    return 'limit' in params or 'cursor' in params
+
+def parse_page_params(params: Dict[str, Any]) -> Tuple[int, Optional[Tuple[str, int]]]:
+    """Разбирает limit и курсор (created_at, id) из параметров запроса"""
+    limit = int(params.get('limit') or PAGE_DEFAULT_LIMIT)
+    if limit < 1:
+        raise ValueError('limit must be positive')
+    cursor = params.get('cursor')
+    if not cursor:
+        return min(limit, PAGE_MAX_LIMIT), None
+    created_at, row_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').rsplit('|', 1)
+    datetime.fromisoformat(created_at)
+    return min(limit, PAGE_MAX_LIMIT), (created_at, int(row_id))
+
+def encode_cursor(row: Dict[str, Any]) -> str:
+    """Курсор следующей страницы по последней строке"""
+    raw = f"{row['created_at']}|{row['id']}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def build_stories_query(project_id: int, params: Dict[str, Any], limit: Optional[int], after: Optional[Tuple[str, int]]) -> Tuple[str, List[Any]]:
+    """Запрос user stories с фильтрами и keyset-пагинацией по (created_at, id)"""
+    conditions = ['project_id = %s']
+    args: List[Any] = [project_id]
+    if params.get('priority'):
+        conditions.append('priority = %s')
+        args.append(params['priority'])
+    if params.get('epic'):
+        conditions.append('epic = %s')
+        args.append(params['epic'])
+    if after is not None:
+        conditions.append('(created_at, id) < (%s::timestamp, %s)')
+        args.extend(after)
+    query = f'''
+        SELECT id, role, action, benefit, priority, epic,
+               created_at, updated_at
+        FROM user_stories
+        WHERE {' AND '.join(conditions)}
+        ORDER BY created_at DESC, id DESC
+    '''
+    if limit is not None:
+        query += ' LIMIT %s'
+        args.append(limit + 1)
+    return query, args
+
+def build_comments_query(project_id: int, story_id: Any, limit: Optional[int], after: Optional[Tuple[str, int]]) -> Tuple[str, List[Any]]:
+    """Запрос комментариев истории проекта с keyset-пагинацией по (created_at, id)"""
+    conditions = ['story_id = %s', 'EXISTS (SELECT 1 FROM user_stories s WHERE s.id = comments.story_id AND s.project_id = %s)']
+    args: List[Any] = [story_id, project_id]
+    if after is not None:
+        conditions.append('(created_at, id) > (%s::timestamp, %s)')
+        args.extend(after)
+    query = f'''
+        SELECT id, author, text, created_at
+        FROM comments
+        WHERE {' AND '.join(conditions)}
+        ORDER BY created_at ASC, id ASC
+    '''
+    if limit is not None:
+        query += ' LIMIT %s'
+        args.append(limit + 1)
+    return query, args
+
+def page_body(rows: List[Dict[str, Any]], limit: int) -> Dict[str, Any]:
+    """Страница результатов и курсор следующей страницы"""
+    items = rows[:limit]
+    next_cursor = encode_cursor(items[-1]) if len(rows) > limit else None
+    return {'items': items, 'next_cursor': next_cursor}
+
+def parse_project_id(event: Dict[str, Any], params: Dict[str, Any]) -> int:
+    """Проект запроса из ?project_id= или X-Project-Id (по умолчанию DEFAULT_PROJECT_ID)"""
+    raw = params.get('project_id') or get_header(event, 'X-Project-Id')
+    if not raw:
+        return DEFAULT_PROJECT_ID
+    project_id = int(raw)
+    if project_id < 1:
+        raise ValueError('project_id must be positive')
+    return project_id
+
+_known_projects: Set[int] = set()
+
+def project_exists(cur, project_id: int) -> bool:
+    """Проверяет, что проект существует; найденные id запоминаются на время жизни процесса"""
+    if project_id in _known_projects:
+        return True
+    cur.execute('SELECT 1 FROM projects WHERE id = %s', (project_id,))
+    if cur.fetchone() is None:
+        return False
+    _known_projects.add(project_id)
+    return True
+
+def bad_request_response(error: str) -> Dict[str, Any]:
+    """Ответ 400 с описанием ошибки"""
+    return {
+        'statusCode': 400,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'error': error}),
+        'isBase64Encoded': False
+    }
+
+COMMENTS_BATCH_MAX_STORIES = 500
+
+def parse_story_ids(params: Dict[str, Any]) -> List[int]:
+    """Разбирает story_ids=1,2,3 в список идентификаторов"""
+    story_ids = sorted({int(value) for value in params['story_ids'].split(',') if value.strip()})
+    if not story_ids:
+        raise ValueError('story_ids must not be empty')
+    if len(story_ids) > COMMENTS_BATCH_MAX_STORIES:
+        raise ValueError(f'at most {COMMENTS_BATCH_MAX_STORIES} story_ids per request')
+    return story_ids
+
+def build_comments_batch_query(project_id: int, story_ids: List[int], per_story: Optional[int]) -> Tuple[str, List[Any]]:
+    """Один запрос комментариев сразу для многих историй, с лимитом последних N на историю"""
+    if per_story is None:
+        return '''
+            SELECT story_id, id, author, text, created_at,
+                   count(*) OVER (PARTITION BY story_id) AS total
+            FROM comments
+            WHERE story_id = ANY(%s)
+              AND EXISTS (SELECT 1 FROM user_stories s WHERE s.id = comments.story_id AND s.project_id = %s)
+            ORDER BY story_id, created_at ASC, id ASC
+        ''', [story_ids, project_id]
+    return '''
+        SELECT story_id, id, author, text, created_at, total
+        FROM (
+            SELECT story_id, id, author, text, created_at,
+                   row_number() OVER (PARTITION BY story_id ORDER BY created_at DESC, id DESC) AS position,
+                   count(*) OVER (PARTITION BY story_id) AS total
+            FROM comments
+            WHERE story_id = ANY(%s)
+              AND EXISTS (SELECT 1 FROM user_stories s WHERE s.id = comments.story_id AND s.project_id = %s)
+        ) ranked
+        WHERE position <= %s
+        ORDER BY story_id, created_at ASC, id ASC
+    ''', [story_ids, project_id, per_story]
+
+def group_comments(story_ids: List[int], rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Группирует комментарии по истории и считает их общее число"""
+    comments: Dict[str, List[Dict[str, Any]]] = {str(story_id): [] for story_id in story_ids}
+    totals: Dict[str, int] = {str(story_id): 0 for story_id in story_ids}
+    for row in rows:
+        story_key = str(row['story_id'])
+        totals[story_key] = row['total']
+        comments[story_key].append({
+            'id': row['id'], 'author': row['author'], 'text': row['text'], 'created_at': row['created_at']
+        })
+    return {'comments': comments, 'totals': totals}
+
+SEARCH_MAX_QUERY_LENGTH = 200
+SEARCH_HEADLINE_OPTIONS = 'StartSel=<b>, StopSel=</b>, MaxWords=25, MinWords=8, MaxFragments=2'
+SEARCH_SOURCES: Dict[str, str] = {
+    'stories': '''
+        SELECT 'story' AS type, s.id, s.id AS story_id,
+               ts_rank(s.search_vector, query.tsq, 32) AS rank,
+               concat_ws(' ', s.role, s.action, s.benefit, s.epic) AS document
+        FROM user_stories s, query
+        WHERE s.project_id = %(project_id)s AND s.search_vector @@ query.tsq
+    ''',
+    'comments': '''
+        SELECT 'comment' AS type, c.id, c.story_id,
+               ts_rank(c.search_vector, query.tsq, 32) AS rank,
+               c.text AS document
+        FROM comments c
+        JOIN user_stories s ON s.id = c.story_id, query
+        WHERE s.project_id = %(project_id)s AND c.search_vector @@ query.tsq
+    ''',
+    'okrs': '''
+        SELECT 'okr' AS type, o.id, NULL::integer AS story_id,
+               ts_rank(o.search_vector, query.tsq, 32) AS rank,
+               concat_ws('. ', o.objective, CASE WHEN jsonb_typeof(o.key_results) = 'array'
+                   THEN (SELECT string_agg(value, '; ') FROM jsonb_array_elements_text(o.key_results)) END) AS document
+        FROM project_okrs o, query
+        WHERE o.project_id = %(project_id)s AND o.search_vector @@ query.tsq
+    '''
+}
+
+def parse_search_params(params: Dict[str, Any]) -> Tuple[str, List[str], int, int]:
+    """Разбирает q, types, limit и курсор (смещение) для поиска"""
+    text = ' '.join((params.get('q') or '').split())
+    if not text:
+        raise ValueError('q is required')
+    if len(text) > SEARCH_MAX_QUERY_LENGTH:
+        raise ValueError(f'q must be at most {SEARCH_MAX_QUERY_LENGTH} characters')
+    requested = params.get('types')
+    types = list(SEARCH_SOURCES)
+    if requested:
+        selected = {value.strip() for value in requested.split(',')}
+        unknown = sorted(selected - set(SEARCH_SOURCES))
+        if unknown:
+            raise ValueError(f'unknown types: {", ".join(unknown)}')
+        types = [name for name in SEARCH_SOURCES if name in selected]
+    limit = int(params.get('limit') or PAGE_DEFAULT_LIMIT)
+    if limit < 1:
+        raise ValueError('limit must be positive')
+    offset = 0
+    if params.get('cursor'):
+        offset = int(base64.urlsafe_b64decode(params['cursor'].encode('ascii')).decode('ascii'))
+        if offset < 0:
+            raise ValueError('cursor must not be negative')
+    return text, types, min(limit, PAGE_MAX_LIMIT), offset
+
+def build_search_query(types: List[str]) -> str:
+    """
+    Ранжированный поиск по выбранным разделам проекта
+    Запрос разбирается russian (стемминг) и simple (точные слова), сниппеты строятся только для страницы
+    """
+    hits = ' UNION ALL '.join(f'({SEARCH_SOURCES[name]})' for name in types)
+    return f'''
+        WITH query AS (
+            SELECT websearch_to_tsquery('russian', %(q)s) || websearch_to_tsquery('simple', %(q)s) AS tsq
+        ), page AS (
+            SELECT * FROM ({hits}) hits
+            ORDER BY rank DESC, type, id
+            LIMIT %(limit)s OFFSET %(offset)s
+        )
+        SELECT page.type, page.id, page.story_id, page.rank,
+               ts_headline('russian', page.document, query.tsq, %(headline_options)s) AS snippet
+        FROM page, query
+        ORDER BY page.rank DESC, page.type, page.id
+    '''
+
+def search_page_body(rows: List[Dict[str, Any]], limit: int, offset: int) -> Dict[str, Any]:
+    """Страница результатов поиска и курсор следующей страницы"""
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = base64.urlsafe_b64encode(str(offset + limit).encode('ascii')).decode('ascii')
+    return {'items': rows[:limit], 'next_cursor': next_cursor}
+
+CHANGES_CHANNEL = 'project_changes'
+CHANGES_LOCK_NAMESPACE = 16
+CHANGES_DEFAULT_LIMIT = 200
+CHANGES_MAX_LIMIT = 1000
+CHANGES_MAX_WAIT = float(os.environ.get('CHANGES_MAX_WAIT', '20'))
+
+def record_changes(cur, project_id: int, entity: str, operation: str, changes: List[Tuple[int, Optional[Dict[str, Any]]]]) -> Optional[int]:
+    """
+    Пишет изменения в change_log и шлет pg_notify (доставляется слушателям после коммита)
+    Advisory-блокировка проекта до конца транзакции: seq коммитятся по возрастанию и поллер их не пропустит
+    """
+    if not changes:
+        return None
+    cur.execute('SELECT pg_advisory_xact_lock(%s, %s)', (CHANGES_LOCK_NAMESPACE, project_id))
+    values = [(entity_id, serialize(payload) if payload is not None else None) for entity_id, payload in changes]
+    query = sql.SQL('''
+        WITH inserted AS (
+            INSERT INTO change_log (project_id, entity, entity_id, operation, payload)
+            SELECT {project_id}, {entity}, v.entity_id, {operation}, v.payload::jsonb
+            FROM (VALUES %s) AS v(entity_id, payload)
+            RETURNING seq
+        )
+        SELECT pg_notify({channel}, json_build_object('project_id', {project_id}, 'seq', max(seq))::text), max(seq) AS seq
+        FROM inserted
+    ''').format(
+        project_id=sql.Literal(project_id), entity=sql.Literal(entity),
+        operation=sql.Literal(operation), channel=sql.Literal(CHANGES_CHANNEL))
+    
+    rows = execute_values(cur, query, values, template='(%s::integer, %s::text)', page_size=len(values), fetch=True)
+    return rows[0]['seq']
+
+def parse_changes_params(params: Dict[str, Any]) -> Tuple[Optional[int], int, float]:
+    """Разбирает since, limit и wait (секунды long-poll) для ленты изменений"""
+    since = int(params['since']) if params.get('since') else None
+    if since is not None and since < 0:
+        raise ValueError('since must not be negative')
+    limit = int(params.get('limit') or CHANGES_DEFAULT_LIMIT)
+    if limit < 1:
+        raise ValueError('limit must be positive')
+    wait = float(params.get('wait') or 0)
+    if not math.isfinite(wait) or wait < 0:
+        raise ValueError('wait must be a non-negative number')
+    return since, min(limit, CHANGES_MAX_LIMIT), min(wait, CHANGES_MAX_WAIT)
+
+def fetch_changes(cur, project_id: int, since: Optional[int], limit: int) -> Dict[str, Any]:
+    """Изменения проекта после since; без since - только текущий last_seq"""
+    if since is None:
+        cur.execute('SELECT COALESCE(max(seq), 0) AS seq FROM change_log WHERE project_id = %s', (project_id,))
+        return {'changes': [], 'last_seq': cur.fetchone()['seq'], 'has_more': False}
+    changes = query_records(cur, '''
+        SELECT seq, entity, entity_id, operation, payload, created_at
+        FROM change_log
+        WHERE project_id = %s AND seq > %s
+        ORDER BY seq ASC
+        LIMIT %s
+    ''', (project_id, since, limit + 1))
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    return {'changes': changes, 'last_seq': changes[-1]['seq'] if changes else since, 'has_more': has_more}
+
+def wait_for_change(conn, project_id: int, deadline: float) -> bool:
+    """
+    Ждет NOTIFY по проекту на соединении, подписанном через LISTEN
+    poll() перед select забирает уведомления, которые libpq уже прочитал из сокета вместе с ответом на commit
+    """
+    while True:
+        conn.poll()
+        notifies, conn.notifies[:] = list(conn.notifies), []
+        if any(json.loads(notify.payload).get('project_id') == project_id for notify in notifies):
+            return True
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        if select.select([conn], [], [], remaining) == ([], [], []):
+            return False
+
+BULK_FORMATS = ('ndjson', 'csv')
+BULK_CONTENT_TYPES = {'ndjson': 'application/x-ndjson; charset=utf-8', 'csv': 'text/csv; charset=utf-8'}
+NDJSON_COPY_OPTIONS = "FORMAT csv, DELIMITER E'\\x01', QUOTE E'\\x02'"
+BULK_ENTITIES: Dict[str, Dict[str, str]] = {
+    'okrs': {
+        'record_type': 'okr',
+        'columns': 'id, objective, key_results, created_at',
+        'export': '''
+            SELECT id, objective, key_results, created_at::text AS created_at
+            FROM project_okrs
+            WHERE project_id = {project_id}
+            ORDER BY id
+        '''
+    },
+    'stories': {
+        'record_type': 'story',
+        'columns': 'id, role, action, benefit, priority, epic, created_at',
+        'export': '''
+            SELECT id, role, action, benefit, priority, epic, created_at::text AS created_at
+            FROM user_stories
+            WHERE project_id = {project_id}
+            ORDER BY id
+        '''
+    },
+    'acceptance-criteria': {
+        'record_type': 'criterion',
+        'columns': 'id, story_id, given_condition, when_action, then_result, created_at',
+        'export': '''
+            SELECT ac.id, ac.story_id, ac.given_condition, ac.when_action, ac.then_result, ac.created_at::text AS created_at
+            FROM acceptance_criteria ac
+            JOIN user_stories s ON s.id = ac.story_id
+            WHERE s.project_id = {project_id}
+            ORDER BY ac.id
+        '''
+    },
+    'comments': {
+        'record_type': 'comment',
+        'columns': 'id, story_id, author, text, created_at',
+        'export': '''
+            SELECT c.id, c.story_id, c.author, c.text, c.created_at::text AS created_at
+            FROM comments c
+            JOIN user_stories s ON s.id = c.story_id
+            WHERE s.project_id = {project_id}
+            ORDER BY c.id
+        '''
+    },
+    'arch-elements': {
+        'record_type': 'arch_element',
+        'columns': 'id, canvas_type, type, name, x, y',
+        'export': '''
+            SELECT id, canvas_type, element_type AS type, name, x_position AS x, y_position AS y
+            FROM architecture_elements
+            WHERE project_id = {project_id}
+            ORDER BY id
+        '''
+    }
+}
+IMPORT_STATEMENTS: List[Tuple[str, str]] = [
+    ('stories', '''
+        INSERT INTO user_stories (id, project_id, role, action, benefit, priority, epic, created_at)
+        SELECT new_id, %(project_id)s, doc->>'role', doc->>'action', doc->>'benefit', doc->>'priority',
+               doc->>'epic', COALESCE((doc->>'created_at')::timestamp, CURRENT_TIMESTAMP)
+        FROM import_story_ids
+    '''),
+    ('acceptance-criteria', '''
+        INSERT INTO acceptance_criteria (story_id, given_condition, when_action, then_result, created_at)
+        SELECT r.new_id, d.doc->>'given_condition', d.doc->>'when_action', d.doc->>'then_result',
+               COALESCE((d.doc->>'created_at')::timestamp, CURRENT_TIMESTAMP)
+        FROM import_docs d
+        JOIN import_story_refs r ON r.ref = (d.doc->>'story_id')::integer
+        WHERE d.doc->>'record_type' = 'criterion'
+    '''),
+    ('comments', '''
+        INSERT INTO comments (story_id, author, text, created_at)
+        SELECT r.new_id, d.doc->>'author', d.doc->>'text',
+               COALESCE((d.doc->>'created_at')::timestamp, CURRENT_TIMESTAMP)
+        FROM import_docs d
+        JOIN import_story_refs r ON r.ref = (d.doc->>'story_id')::integer
+        WHERE d.doc->>'record_type' = 'comment'
+    '''),
+    ('okrs', '''
+        INSERT INTO project_okrs (project_id, objective, key_results, created_at)
+        SELECT %(project_id)s, doc->>'objective',
+               CASE WHEN jsonb_typeof(doc->'key_results') = 'string' THEN (doc->>'key_results')::jsonb ELSE doc->'key_results' END,
+               COALESCE((doc->>'created_at')::timestamp, CURRENT_TIMESTAMP)
+        FROM import_docs
+        WHERE doc->>'record_type' = 'okr'
+    '''),
+    ('arch-elements', '''
+        INSERT INTO architecture_elements (project_id, canvas_type, element_type, name, x_position, y_position)
+        SELECT %(project_id)s, COALESCE(doc->>'canvas_type', 'context'), doc->>'type', doc->>'name',
+               (doc->>'x')::integer, (doc->>'y')::integer
+        FROM import_docs
+        WHERE doc->>'record_type' = 'arch_element'
+    ''')
+]
+
+def parse_bulk_params(params: Dict[str, Any]) -> Tuple[str, Optional[str]]:
+    """Разбирает format и entity для импорта/экспорта (для CSV entity обязателен)"""
+    fmt = params.get('format') or 'ndjson'
+    if fmt not in BULK_FORMATS:
+        raise ValueError(f'format must be one of: {", ".join(BULK_FORMATS)}')
+    entity = params.get('entity')
+    if fmt == 'csv' and not entity:
+        raise ValueError('entity is required for csv')
+    if entity and entity not in BULK_ENTITIES:
+        raise ValueError(f'entity must be one of: {", ".join(BULK_ENTITIES)}')
+    return fmt, entity
+
+def build_export_query(cur, project_id: int, fmt: str, entity: Optional[str]) -> str:
+    """
+    COPY TO STDOUT для экспорта: CSV одной сущности или NDJSON (строка JSON на запись)
+    JSON собирает Postgres, разделители \\x01/\\x02 не дают COPY экранировать обратные слеши
+    """
+    names = [entity] if entity else list(BULK_ENTITIES)
+    selects = [
+        sql.SQL(BULK_ENTITIES[name]['export']).format(project_id=sql.Literal(project_id))
+        for name in names
+    ]
+    if fmt == 'csv':
+        return sql.SQL('COPY ({}) TO STDOUT WITH (FORMAT csv, HEADER true)').format(selects[0]).as_string(cur)
+    rows = sql.SQL(' UNION ALL ').join(
+        sql.SQL("(SELECT (to_jsonb(e) || jsonb_build_object('record_type', {}))::text FROM ({}) e)").format(
+            sql.Literal(BULK_ENTITIES[name]['record_type']), select)
+        for name, select in zip(names, selects)
+    )
+    return sql.SQL('COPY ({}) TO STDOUT WITH ({})').format(rows, sql.SQL(NDJSON_COPY_OPTIONS)).as_string(cur)
+
+def read_body_stream(event: Dict[str, Any]) -> io.StringIO:
+    """Тело запроса как файловый объект для copy_expert"""
+    body = event.get('body') or ''
+    if event.get('isBase64Encoded'):
+        body = base64.b64decode(body).decode('utf-8')
+    return io.StringIO(body)
+
+def import_project_data(cur, project_id: int, fmt: str, entity: Optional[str], stream: Any) -> Dict[str, int]:
+    """
+    Импорт одной транзакцией: COPY во временную таблицу, затем INSERT ... SELECT по сущностям
+    Новые id историй выделяются заранее из sequence, ссылки story_id переводятся через import_story_refs
+    (история из того же файла или уже существующая история проекта)
+    """
+    cur.execute('CREATE TEMP TABLE import_docs (doc jsonb) ON COMMIT DROP')
+    if fmt == 'csv':
+        columns = BULK_ENTITIES[entity]['columns']
+        cur.execute(f"CREATE TEMP TABLE import_csv ({', '.join(f'{name} text' for name in columns.split(', '))}) ON COMMIT DROP")
+        cur.copy_expert(f'COPY import_csv ({columns}) FROM STDIN WITH (FORMAT csv, HEADER true)', stream)
+        cur.execute('''
+            INSERT INTO import_docs (doc)
+            SELECT jsonb_strip_nulls(to_jsonb(import_csv)) || jsonb_build_object('record_type', %s::text)
+            FROM import_csv
+        ''', (BULK_ENTITIES[entity]['record_type'],))
+    else:
+        cur.copy_expert(f'COPY import_docs (doc) FROM STDIN WITH ({NDJSON_COPY_OPTIONS})', stream)
+        cur.execute('DELETE FROM import_docs WHERE doc IS NULL')
+    
+    known_types = [BULK_ENTITIES[name]['record_type'] for name in BULK_ENTITIES]
+    cur.execute('''
+        SELECT array_agg(DISTINCT COALESCE(doc->>'record_type', 'null')) AS unknown
+        FROM import_docs
+        WHERE doc->>'record_type' IS NULL OR NOT doc->>'record_type' = ANY(%s)
+    ''', (known_types,))
+    unknown = cur.fetchone()['unknown']
+    if unknown:
+        raise ValueError(f"unknown record types: {', '.join(unknown)}")
+    
+    cur.execute('''
+        CREATE TEMP TABLE import_story_ids ON COMMIT DROP AS
+        SELECT (doc->>'id')::integer AS src_id,
+               nextval(pg_get_serial_sequence('user_stories', 'id'))::integer AS new_id,
+               doc
+        FROM import_docs
+        WHERE doc->>'record_type' = 'story'
+    ''')
+    cur.execute('''
+        SELECT src_id FROM import_story_ids
+        WHERE src_id IS NOT NULL
+        GROUP BY src_id HAVING count(*) > 1
+        LIMIT 5
+    ''')
+    duplicates = [row['src_id'] for row in cur.fetchall()]
+    if duplicates:
+        raise ValueError(f"duplicate story ids: {', '.join(map(str, duplicates))}")
+    
+    cur.execute('''
+        CREATE TEMP TABLE import_story_refs ON COMMIT DROP AS
+        SELECT refs.ref, COALESCE(m.new_id, s.id) AS new_id
+        FROM (
+            SELECT DISTINCT (doc->>'story_id')::integer AS ref
+            FROM import_docs
+            WHERE doc->>'record_type' IN ('criterion', 'comment')
+        ) refs
+        LEFT JOIN import_story_ids m ON m.src_id = refs.ref
+        LEFT JOIN user_stories s ON s.id = refs.ref AND s.project_id = %(project_id)s
+    ''', {'project_id': project_id})
+    cur.execute('SELECT ref FROM import_story_refs WHERE new_id IS NULL ORDER BY ref LIMIT 5')
+    missing = [row['ref'] for row in cur.fetchall()]
+    if missing:
+        raise ValueError(f"unknown story_id references: {', '.join(map(str, missing))}")
+    
+    imported: Dict[str, int] = {}
+    for name, statement in IMPORT_STATEMENTS:
+        cur.execute(statement, {'project_id': project_id})
+        imported[name] = cur.rowcount
+    return imported
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """
+    Точка входа функции: обрабатывает запрос и замеряет фазы connect/execute/fetch/serialize
+    Тайминги уходят в заголовок Server-Timing и в гистограммы для ?action=metrics
+    """
+    global _invocations
+    _invocations += 1
+    cold_start = _invocations == 1
+    timings: Dict[str, float] = {}
+    _request_state.timings = timings
+    started = time.perf_counter()
+    try:
+        response = route_request(event, context)
+    finally:
+        _request_state.timings = None
+    timings['total'] = time.perf_counter() - started
+    
+    params = event.get('queryStringParameters') or {}
+    observe_request(f"{event.get('httpMethod', 'GET')} {params.get('action', '')}", timings)
+    response['headers']['Server-Timing'] = server_timing_header(timings, cold_start)
+    response['headers']['Timing-Allow-Origin'] = '*'
+    return response
+
+def route_request(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
     API для управления проектами, user stories, комментариями и архитектурными элементами
+    Проект выбирается через ?project_id= или заголовок X-Project-Id (по умолчанию 1)
     
     GET /?action=vision - получить Vision & Goals проекта
     PUT /?action=vision - обновить Vision & Goals
     GET /?action=okrs - получить OKR проекта
     POST /?action=okrs - создать новый OKR
-    GET /?action=stories - получить все User Stories
+    GET /?action=stories&priority=&epic=&limit=&cursor= - получить User Stories (с limit/cursor - постранично)
     POST /?action=stories - создать User Story
-    GET /?action=comments&story_id=X - получить комментарии
+    GET /?action=comments&story_id=X&limit=&cursor= - получить комментарии (с limit/cursor - постранично)
+    GET /?action=comments&story_ids=1,2,3&per_story=N - комментарии многих историй, сгруппированные по истории
     POST /?action=comments - добавить комментарий
     GET /?action=arch-elements - получить архитектурные элементы
-    PUT /?action=arch-elements - обновить позицию элемента
+    PUT /?action=arch-elements - обновить позицию элемента {id, x, y, client_ts} (или пакет {elements: [...]})
     POST /?action=arch-elements - создать архитектурный элемент
+    GET /?action=search&q=&types=stories,comments,okrs&limit=&cursor= - полнотекстовый поиск с ранжированием и сниппетами
+    GET /?action=changes&since=&limit=&wait= - лента изменений проекта после seq (wait - long-poll через LISTEN, сек)
+    GET /?action=export&format=ndjson|csv&entity= - выгрузка данных проекта через COPY (CSV - одна сущность)
+    POST /?action=import&format=ndjson|csv&entity= - загрузка одной транзакцией с переназначением id историй
+    GET /?action=bootstrap&fields=vision,okrs,stories,arch_elements - все данные для первой загрузки одним запросом
+    GET /?action=pool-stats - счетчики пула подключений к БД
+    GET /?action=cache-stats - счетчики кэша ответов
+    GET /?action=metrics - гистограммы времени по действиям (только при METRICS_ENABLED=1)
     """
     method: str = event.get('httpMethod', 'GET')
     params = event.get('queryStringParameters') or {}
@@ -34,30 +1067,114 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
+                'Access-Control-Allow-Headers': 'Content-Type, If-None-Match, X-Project-Id',
                 'Access-Control-Max-Age': '86400'
             },
             'body': '',
             'isBase64Encoded': False
         }
     
+    if method == 'GET' and action == 'pool-stats':
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps(get_pool_stats()),
+            'isBase64Encoded': False
+        }
+    
+    if method == 'GET' and action == 'metrics' and METRICS_ENABLED:
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps(get_metrics()),
+            'isBase64Encoded': False
+        }
+    
+    if method == 'GET' and action == 'cache-stats':
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps(get_cache_stats()),
+            'isBase64Encoded': False
+        }
+    
+    try:
+        project_id = parse_project_id(event, params)
+    except ValueError as e:
+        return bad_request_response(f'Invalid project_id: {e}')
+    
+    cache_key = make_cache_key(action, project_id, params) if method == 'GET' and action in CACHEABLE_ACTIONS else None
+    if_none_match = get_header(event, 'If-None-Match')
+    if cache_key is not None:
+        cached = cache_get(cache_key)
+        if cached is not None:
+            cached_body, cached_etag = cached
+            if etag_matches(if_none_match, cached_etag):
+                return not_modified_response(cached_etag, 'HIT')
+            return {
+                'statusCode': 200,
+                'headers': read_headers(cached_etag, 'HIT'),
+                'body': cached_body,
+                'isBase64Encoded': False
+            }
+    
+    connect_started = time.perf_counter()
     conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
+    record_phase('connect', time.perf_counter() - connect_started)
+    cur = conn.cursor(cursor_factory=TimedCursor)
+    broken = False
     
     try:
-        if method == 'GET' and action == 'vision':
+        if not project_exists(cur, project_id):
+            return {
+                'statusCode': 404,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Project not found'}),
+                'isBase64Encoded': False
+            }
+        
+        etag = ''
+        if cache_key is not None:
+            try:
+                version_query, version_args = build_version_query(action, project_id, params)
+            except ValueError as e:
+                return bad_request_response(f'Invalid parameters: {e}')
+            cur.execute(version_query, version_args)
+            etag = make_etag(cache_key, cur.fetchone()['version'])
+            if etag_matches(if_none_match, etag):
+                return not_modified_response(etag, 'MISS')
+        
+        if method == 'GET' and action == 'bootstrap':
+            fields = parse_bootstrap_fields(params)[0]
+            cur.execute(build_bootstrap_query(fields), {'project_id': project_id})
+            bootstrap = cur.fetchone()
+            
+            body = bootstrap['bootstrap']
+            cache_put(cache_key, body, etag)
+            
+            return {
+                'statusCode': 200,
+                'headers': read_headers(etag, 'MISS'),
+                'body': body,
+                'isBase64Encoded': False
+            }
+        
+        elif method == 'GET' and action == 'vision':
             cur.execute('''
                 SELECT vision, target_audience, value_proposition, 
                        timeline, budget, success_metric
                 FROM projects 
-                WHERE id = 1
-            ''')
+                WHERE id = %s
+            ''', (project_id,))
             vision_data = cur.fetchone()
             
+            body = serialize(dict(vision_data) if vision_data else {})
+            cache_put(cache_key, body, etag)
+            
             return {
                 'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps(dict(vision_data) if vision_data else {}, default=str),
+                'headers': read_headers(etag, 'MISS'),
+                'body': body,
                 'isBase64Encoded': False
             }
         
@@ -68,7 +1185,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 SET vision = %s, target_audience = %s, value_proposition = %s,
                     timeline = %s, budget = %s, success_metric = %s,
                     updated_at = CURRENT_TIMESTAMP
-                WHERE id = 1
+                WHERE id = %s
                 RETURNING vision, target_audience, value_proposition, timeline, budget, success_metric
             ''', (
                 data.get('vision', ''), 
@@ -76,32 +1193,36 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 data.get('value_proposition', ''),
                 data.get('timeline', ''),
                 data.get('budget', ''),
-                data.get('success_metric', '')
+                data.get('success_metric', ''),
+                project_id
             ))
             
             updated_vision = cur.fetchone()
+            if updated_vision:
+                record_changes(cur, project_id, 'vision', 'update', [(project_id, dict(updated_vision))])
             conn.commit()
+            invalidate_cache(project_id, WRITE_INVALIDATES['vision'])
             
             return {
                 'statusCode': 200,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps(dict(updated_vision) if updated_vision else {}, default=str),
+                'body': serialize(dict(updated_vision) if updated_vision else {}),
                 'isBase64Encoded': False
             }
         
         elif method == 'GET' and action == 'okrs':
-            cur.execute('''
+            body = query_json(cur, '''
                 SELECT id, objective, key_results, created_at, updated_at
                 FROM project_okrs
-                WHERE project_id = 1
+                WHERE project_id = %s
                 ORDER BY created_at ASC
-            ''')
-            okrs = cur.fetchall()
+            ''', (project_id,))
+            cache_put(cache_key, body, etag)
             
             return {
                 'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps([dict(row) for row in okrs], default=str),
+                'headers': read_headers(etag, 'MISS'),
+                'body': body,
                 'isBase64Encoded': False
             }
         
@@ -109,17 +1230,19 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             data = json.loads(event.get('body', '{}'))
             cur.execute('''
                 INSERT INTO project_okrs (project_id, objective, key_results)
-                VALUES (1, %s, %s)
+                VALUES (%s, %s, %s)
                 RETURNING id, objective, key_results, created_at
-            ''', (data['objective'], json.dumps(data['key_results'])))
+            ''', (project_id, data['objective'], json.dumps(data['key_results'])))
             
             new_okr = cur.fetchone()
+            record_changes(cur, project_id, 'okrs', 'insert', [(new_okr['id'], dict(new_okr))])
             conn.commit()
+            invalidate_cache(project_id, WRITE_INVALIDATES['okrs'])
             
             return {
                 'statusCode': 201,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps(dict(new_okr), default=str),
+                'body': serialize(dict(new_okr)),
                 'isBase64Encoded': False
             }
         
@@ -128,17 +1251,20 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             cur.execute('''
                 UPDATE project_okrs
                 SET objective = %s, key_results = %s, updated_at = CURRENT_TIMESTAMP
-                WHERE id = %s AND project_id = 1
+                WHERE id = %s AND project_id = %s
                 RETURNING id, objective, key_results, updated_at
-            ''', (data['objective'], json.dumps(data['key_results']), data['id']))
+            ''', (data['objective'], json.dumps(data['key_results']), data['id'], project_id))
             
             updated_okr = cur.fetchone()
+            if updated_okr:
+                record_changes(cur, project_id, 'okrs', 'update', [(updated_okr['id'], dict(updated_okr))])
             conn.commit()
+            invalidate_cache(project_id, WRITE_INVALIDATES['okrs'])
             
             return {
                 'statusCode': 200,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps(dict(updated_okr) if updated_okr else {}, default=str),
+                'body': serialize(dict(updated_okr) if updated_okr else {}),
                 'isBase64Encoded': False
             }
         
@@ -146,34 +1272,42 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             okr_id = params.get('id')
             cur.execute('''
                 DELETE FROM project_okrs
-                WHERE id = %s AND project_id = 1
+                WHERE id = %s AND project_id = %s
                 RETURNING id
-            ''', (okr_id,))
+            ''', (okr_id, project_id))
             
             deleted_okr = cur.fetchone()
+            if deleted_okr:
+                record_changes(cur, project_id, 'okrs', 'delete', [(deleted_okr['id'], None)])
             conn.commit()
+            invalidate_cache(project_id, WRITE_INVALIDATES['okrs'])
             
             return {
                 'statusCode': 200,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'success': True, 'id': dict(deleted_okr)['id'] if deleted_okr else None}, default=str),
+                'body': serialize({'success': True, 'id': dict(deleted_okr)['id'] if deleted_okr else None}),
                 'isBase64Encoded': False
             }
         
         elif method == 'GET' and action == 'stories':
-            cur.execute('''
-                SELECT id, role, action, benefit, priority, epic, 
-                       created_at, updated_at 
-                FROM user_stories 
-                WHERE project_id = 1
-                ORDER BY created_at DESC
-            ''')
-            stories = cur.fetchall()
+            limit, after = None, None
+            if is_paginated(params):
+                try:
+                    limit, after = parse_page_params(params)
+                except ValueError as e:
+                    return bad_request_response(f'Invalid pagination parameters: {e}')
+            
+            if limit is None:
+                body = query_json(cur, *build_stories_query(project_id, params, limit, after))
+            else:
+                stories = query_records(cur, *build_stories_query(project_id, params, limit, after))
+                body = serialize(page_body(stories, limit))
+            cache_put(cache_key, body, etag)
             
             return {
                 'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps([dict(row) for row in stories], default=str),
+                'headers': read_headers(etag, 'MISS'),
+                'body': body,
                 'isBase64Encoded': False
             }
         
@@ -181,36 +1315,63 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             data = json.loads(event.get('body', '{}'))
             cur.execute('''
                 INSERT INTO user_stories (project_id, role, action, benefit, priority, epic)
-                VALUES (1, %s, %s, %s, %s, %s)
+                VALUES (%s, %s, %s, %s, %s, %s)
                 RETURNING id, role, action, benefit, priority, epic, created_at
-            ''', (data['role'], data['action'], data['benefit'], data['priority'], data.get('epic', '')))
+            ''', (project_id, data['role'], data['action'], data['benefit'], data['priority'], data.get('epic', '')))
             
             new_story = cur.fetchone()
+            record_changes(cur, project_id, 'stories', 'insert', [(new_story['id'], dict(new_story))])
             conn.commit()
+            invalidate_cache(project_id, WRITE_INVALIDATES['stories'])
             
             return {
                 'statusCode': 201,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps(dict(new_story), default=str),
+                'body': serialize(dict(new_story)),
+                'isBase64Encoded': False
+            }
+        
+        elif method == 'GET' and action == 'comments' and 'story_ids' in params:
+            try:
+                story_ids = parse_story_ids(params)
+                per_story = int(params['per_story']) if params.get('per_story') else None
+                if per_story is not None and per_story < 1:
+                    raise ValueError('per_story must be positive')
+            except ValueError as e:
+                return bad_request_response(f'Invalid parameters: {e}')
+            
+            comments = query_records(cur, *build_comments_batch_query(project_id, story_ids, per_story))
+            
+            body = serialize(group_comments(story_ids, comments))
+            cache_put(cache_key, body, etag)
+            
+            return {
+                'statusCode': 200,
+                'headers': read_headers(etag, 'MISS'),
+                'body': body,
                 'isBase64Encoded': False
             }
         
         elif method == 'GET' and action == 'comments':
             story_id = params.get('story_id')
+            limit, after = None, None
+            if is_paginated(params):
+                try:
+                    limit, after = parse_page_params(params)
+                except ValueError as e:
+                    return bad_request_response(f'Invalid pagination parameters: {e}')
             
-            cur.execute('''
-                SELECT id, author, text, created_at
-                FROM comments
-                WHERE story_id = %s
-                ORDER BY created_at ASC
-            ''', (story_id,))
-            
-            comments = cur.fetchall()
+            if limit is None:
+                body = query_json(cur, *build_comments_query(project_id, story_id, limit, after))
+            else:
+                comments = query_records(cur, *build_comments_query(project_id, story_id, limit, after))
+                body = serialize(page_body(comments, limit))
+            cache_put(cache_key, body, etag)
             
             return {
                 'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps([dict(row) for row in comments], default=str),
+                'headers': read_headers(etag, 'MISS'),
+                'body': body,
                 'isBase64Encoded': False
             }
         
@@ -218,33 +1379,126 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             data = json.loads(event.get('body', '{}'))
             cur.execute('''
                 INSERT INTO comments (story_id, author, text)
-                VALUES (%s, %s, %s)
+                SELECT id, %s, %s
+                FROM user_stories
+                WHERE id = %s AND project_id = %s
                 RETURNING id, author, text, created_at
-            ''', (data['story_id'], data['author'], data['text']))
+            ''', (data['author'], data['text'], data['story_id'], project_id))
             
             new_comment = cur.fetchone()
+            if new_comment is None:
+                return {
+                    'statusCode': 404,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Story not found'}),
+                    'isBase64Encoded': False
+                }
+            record_changes(cur, project_id, 'comments', 'insert', [(new_comment['id'], dict(new_comment, story_id=int(data['story_id'])))])
+            conn.commit()
+            invalidate_cache(project_id, WRITE_INVALIDATES['comments'], {'story_id': data['story_id']})
+            
+            return {
+                'statusCode': 201,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': serialize(dict(new_comment)),
+                'isBase64Encoded': False
+            }
+        
+        elif method == 'GET' and action == 'search':
+            try:
+                text, types, limit, offset = parse_search_params(params)
+            except ValueError as e:
+                return bad_request_response(f'Invalid search parameters: {e}')
+            
+            results = query_records(cur, build_search_query(types), {
+                'project_id': project_id, 'q': text, 'limit': limit + 1, 'offset': offset,
+                'headline_options': SEARCH_HEADLINE_OPTIONS
+            })
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': serialize(search_page_body(results, limit, offset)),
+                'isBase64Encoded': False
+            }
+        
+        elif method == 'GET' and action == 'changes':
+            try:
+                since, limit, wait = parse_changes_params(params)
+            except ValueError as e:
+                return bad_request_response(f'Invalid parameters: {e}')
+            
+            if since is None or not wait:
+                feed = fetch_changes(cur, project_id, since, limit)
+            else:
+                cur.execute(f'LISTEN {CHANGES_CHANNEL}')
+                conn.commit()
+                try:
+                    deadline = time.monotonic() + wait
+                    feed = fetch_changes(cur, project_id, since, limit)
+                    conn.commit()
+                    while not feed['changes'] and wait_for_change(conn, project_id, deadline):
+                        feed = fetch_changes(cur, project_id, since, limit)
+                        conn.commit()
+                finally:
+                    cur.execute('UNLISTEN *')
+                    conn.commit()
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', 'Cache-Control': 'no-store'},
+                'body': serialize(feed),
+                'isBase64Encoded': False
+            }
+        
+        elif method == 'GET' and action == 'export':
+            try:
+                fmt, entity = parse_bulk_params(params)
+            except ValueError as e:
+                return bad_request_response(f'Invalid parameters: {e}')
+            
+            output = io.StringIO()
+            cur.copy_expert(build_export_query(cur, project_id, fmt, entity), output)
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': BULK_CONTENT_TYPES[fmt], 'Access-Control-Allow-Origin': '*'},
+                'body': output.getvalue(),
+                'isBase64Encoded': False
+            }
+        
+        elif method == 'POST' and action == 'import':
+            try:
+                fmt, entity = parse_bulk_params(params)
+                imported = import_project_data(cur, project_id, fmt, entity, read_body_stream(event))
+            except (ValueError, psycopg2.DataError, psycopg2.IntegrityError) as e:
+                conn.rollback()
+                return bad_request_response(f'Invalid import data: {e}')
+            
+            record_changes(cur, project_id, 'project', 'import', [(project_id, imported)])
             conn.commit()
+            invalidate_cache(project_id, CACHEABLE_ACTIONS)
             
             return {
                 'statusCode': 201,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps(dict(new_comment), default=str),
+                'body': serialize({'imported': imported}),
                 'isBase64Encoded': False
             }
         
         elif method == 'GET' and action == 'arch-elements':
-            cur.execute('''
+            body = query_json(cur, '''
                 SELECT id, element_type as type, name, x_position as x, y_position as y
                 FROM architecture_elements
-                WHERE project_id = 1 AND canvas_type = 'context'
+                WHERE project_id = %s AND canvas_type = 'context'
                 ORDER BY id ASC
-            ''')
-            elements = cur.fetchall()
+            ''', (project_id,))
+            cache_put(cache_key, body, etag)
             
             return {
                 'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps([dict(row) for row in elements], default=str),
+                'headers': read_headers(etag, 'MISS'),
+                'body': body,
                 'isBase64Encoded': False
             }
         
@@ -252,36 +1506,63 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             data = json.loads(event.get('body', '{}'))
             cur.execute('''
                 INSERT INTO architecture_elements (project_id, canvas_type, element_type, name, x_position, y_position)
-                VALUES (1, 'context', %s, %s, %s, %s)
+                VALUES (%s, 'context', %s, %s, %s, %s)
                 RETURNING id, element_type as type, name, x_position as x, y_position as y
-            ''', (data['type'], data['name'], data['x'], data['y']))
+            ''', (project_id, data['type'], data['name'], data['x'], data['y']))
             
             new_element = cur.fetchone()
+            record_changes(cur, project_id, 'arch-elements', 'insert', [(new_element['id'], dict(new_element))])
             conn.commit()
+            invalidate_cache(project_id, WRITE_INVALIDATES['arch-elements'])
             
             return {
                 'statusCode': 201,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps(dict(new_element), default=str),
+                'body': serialize(dict(new_element)),
                 'isBase64Encoded': False
             }
         
         elif method == 'PUT' and action == 'arch-elements':
             data = json.loads(event.get('body', '{}'))
-            cur.execute('''
-                UPDATE architecture_elements
-                SET x_position = %s, y_position = %s, updated_at = CURRENT_TIMESTAMP
-                WHERE id = %s AND project_id = 1
-                RETURNING id, element_type as type, name, x_position as x, y_position as y
-            ''', (data['x'], data['y'], data['id']))
             
-            updated_element = cur.fetchone()
+            if isinstance(data, list) or 'elements' in data:
+                items = data if isinstance(data, list) else data['elements']
+                if not items:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Elements are required'}),
+                        'isBase64Encoded': False
+                    }
+                
+                last_write_wins = isinstance(data, dict) and bool(data.get('last_write_wins'))
+                updated_elements = update_element_positions(cur, project_id, items, last_write_wins)
+                record_changes(cur, project_id, 'arch-elements', 'update', [(row['id'], dict(row)) for row in updated_elements])
+                conn.commit()
+                invalidate_cache(project_id, WRITE_INVALIDATES['arch-elements'])
+                
+                updated_ids = {row['id'] for row in updated_elements}
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': serialize({
+                        'updated': [dict(row) for row in updated_elements],
+                        'skipped': sorted({int(item['id']) for item in items} - updated_ids)
+                    }),
+                    'isBase64Encoded': False
+                }
+            
+            updated_rows = update_element_positions(cur, project_id, [data], True)
+            updated_element = updated_rows[0] if updated_rows else None
+            if updated_element:
+                record_changes(cur, project_id, 'arch-elements', 'update', [(updated_element['id'], dict(updated_element))])
             conn.commit()
+            invalidate_cache(project_id, WRITE_INVALIDATES['arch-elements'])
             
             return {
                 'statusCode': 200,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps(dict(updated_element) if updated_element else {}, default=str),
+                'body': serialize(dict(updated_element) if updated_element else {}),
                 'isBase64Encoded': False
             }
         
@@ -293,7 +1574,12 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
         
     except Exception as e:
-        conn.rollback()
+        broken = isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
+        if not broken:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
         return {
             'statusCode': 500,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -301,5 +1587,9 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     finally:
-        cur.close()
-        conn.close()
\ No newline at end of file
+        if not cur.closed:
+            try:
+                cur.close()
+            except psycopg2.Error:
+                broken = True
+        release_db_connection(conn, broken)
\ No newline at end of file
@@ -0,0 +1,368 @@
+"""
+Нагрузочный прогон обеих функций (api и jarvis-ai) в процессе, на синтетических событиях
+Postgres - локальный (DATABASE_URL, миграции уже применены), OpenAI - встроенный фейковый сервер с задержкой
+
+    python backend/benchmarks/bench.py --stories 10000 --concurrency 1,8 --output bench.json
+    python backend/benchmarks/bench.py --compare bench.json
+
+Отчет: p50/p95/p99, пропускная способность на каждом уровне параллельности и аллокации на вызов (tracemalloc)
+"""
+import argparse
+import importlib.util
+import json
+import math
+import os
+import platform
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+EventFactory = Callable[[int], Dict[str, Any]]
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    """Отвечает как chat/completions, в том числе потоком SSE, с настраиваемой задержкой"""
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    latency = 0.0
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def do_POST(self) -> None:
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        time.sleep(self.latency)
+        answer = 'Восхитительно, сэр. ' + payload['messages'][-1]['content'][:40]
+        if payload.get('stream'):
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for word in answer.split(' '):
+                self.write_chunk('data: ' + json.dumps({'choices': [{'delta': {'content': word + ' '}}]}) + '\n\n')
+            self.write_chunk('data: [DONE]\n\n')
+            self.wfile.write(b'0\r\n\r\n')
+            return
+        data = json.dumps({'choices': [{'message': {'content': answer}}]}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def write_chunk(self, text: str) -> None:
+        data = text.encode('utf-8')
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        self.wfile.flush()
+
+def start_fake_openai(latency_ms: float) -> Tuple[ThreadingHTTPServer, str]:
+    """Запускает фейковый OpenAI в фоне и возвращает сервер и URL"""
+    handler = type('LatencyHandler', (FakeOpenAIHandler,), {'latency': latency_ms / 1000})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}/v1/chat/completions'
+
+def load_function(name: str) -> Any:
+    """Импортирует backend/<name>/index.py как отдельный модуль"""
+    spec = importlib.util.spec_from_file_location(f"bench_{name.replace('-', '_')}", os.path.join(BACKEND_DIR, name, 'index.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def seed_project(dsn: str, stories: int, comments_per_story: int, okrs: int, elements: int) -> Dict[str, Any]:
+    """Создает отдельный проект нужного размера через generate_series"""
+    conn = psycopg2.connect(dsn)
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute("INSERT INTO projects (name, vision) VALUES ('Benchmark', 'Нагрузочный проект') RETURNING id")
+    project_id = cur.fetchone()['id']
+    args = {'project_id': project_id, 'stories': stories, 'comments': comments_per_story, 'okrs': okrs, 'elements': elements}
+    cur.execute('''
+        INSERT INTO user_stories (project_id, role, action, benefit, priority, epic, created_at)
+        SELECT %(project_id)s, 'Роль ' || g %% 10, 'настроить интеграцию платежей ' || g, 'сократить ручную работу ' || g,
+               (ARRAY['Must', 'Should', 'Could'])[g %% 3 + 1], 'Эпик ' || g %% 20,
+               CURRENT_TIMESTAMP - g * interval '1 second'
+        FROM generate_series(1, %(stories)s) g
+    ''', args)
+    cur.execute('''
+        INSERT INTO acceptance_criteria (story_id, given_condition, when_action, then_result)
+        SELECT id, 'пользователь авторизован', 'открывает страницу', 'видит данные'
+        FROM user_stories WHERE project_id = %(project_id)s
+    ''', args)
+    cur.execute('''
+        INSERT INTO comments (story_id, author, text)
+        SELECT s.id, 'Автор ' || c, 'комментарий к истории про платежи ' || c
+        FROM user_stories s, generate_series(1, %(comments)s) c
+        WHERE s.project_id = %(project_id)s
+    ''', args)
+    cur.execute('''
+        INSERT INTO project_okrs (project_id, objective, key_results)
+        SELECT %(project_id)s, 'Цель ' || g, jsonb_build_array('Метрика ' || g, 'NPS > 50')
+        FROM generate_series(1, %(okrs)s) g
+    ''', args)
+    cur.execute('''
+        INSERT INTO architecture_elements (project_id, canvas_type, element_type, name, x_position, y_position)
+        SELECT %(project_id)s, 'context', 'Система', 'Сервис ' || g, g * 10 %% 1000, g * 7 %% 800
+        FROM generate_series(1, %(elements)s) g
+    ''', args)
+    cur.execute('SELECT id FROM user_stories WHERE project_id = %s ORDER BY id LIMIT 100', (project_id,))
+    story_ids = [row['id'] for row in cur.fetchall()]
+    cur.execute('SELECT id FROM architecture_elements WHERE project_id = %s ORDER BY id LIMIT 20', (project_id,))
+    element_ids = [row['id'] for row in cur.fetchall()]
+    cur.execute('SHOW server_version')
+    server_version = cur.fetchone()['server_version']
+    conn.commit()
+    conn.close()
+    return {'project_id': project_id, 'story_ids': story_ids, 'element_ids': element_ids, 'server_version': server_version}
+
+def drop_project(dsn: str, project_id: int) -> None:
+    """Удаляет проект бенчмарка со всеми данными"""
+    conn = psycopg2.connect(dsn)
+    cur = conn.cursor()
+    story_ids = 'SELECT id FROM user_stories WHERE project_id = %(project_id)s'
+    for statement in (
+        f'DELETE FROM comments WHERE story_id IN ({story_ids})',
+        f'DELETE FROM acceptance_criteria WHERE story_id IN ({story_ids})',
+        'DELETE FROM change_log WHERE project_id = %(project_id)s',
+        'DELETE FROM user_stories WHERE project_id = %(project_id)s',
+        'DELETE FROM project_okrs WHERE project_id = %(project_id)s',
+        'DELETE FROM architecture_elements WHERE project_id = %(project_id)s',
+        'DELETE FROM projects WHERE id = %(project_id)s'
+    ):
+        cur.execute(statement, {'project_id': project_id})
+    conn.commit()
+    conn.close()
+
+def api_event(method: str, params: Dict[str, str], body: Any = None) -> Dict[str, Any]:
+    """Синтетическое событие вызова функции"""
+    event: Dict[str, Any] = {'httpMethod': method, 'queryStringParameters': params, 'headers': {}, 'isBase64Encoded': False}
+    if body is not None:
+        event['body'] = json.dumps(body, ensure_ascii=False)
+    return event
+
+def build_scenarios(seed: Dict[str, Any]) -> Dict[str, Tuple[str, EventFactory]]:
+    """Сценарии: имя -> (функция, фабрика события по номеру вызова)"""
+    project = str(seed['project_id'])
+    story_ids = seed['story_ids']
+    element_ids = seed['element_ids']
+    batch_ids = ','.join(map(str, story_ids[:20]))
+
+    def read(action: str, **params: str) -> EventFactory:
+        return lambda i: api_event('GET', dict(params, action=action, project_id=project))
+
+    def history(i: int) -> List[Dict[str, str]]:
+        return [
+            {'role': 'user' if turn % 2 == 0 else 'assistant', 'content': f'Реплика {turn} про архитектуру сервиса платежей'}
+            for turn in range(i % 12)
+        ]
+
+    return {
+        'api.vision': ('api', read('vision')),
+        'api.okrs': ('api', read('okrs')),
+        'api.stories': ('api', read('stories')),
+        'api.stories.page': ('api', read('stories', limit='50')),
+        'api.comments': ('api', lambda i: api_event('GET', {'action': 'comments', 'project_id': project, 'story_id': str(story_ids[i % len(story_ids)])})),
+        'api.comments.batch': ('api', read('comments', story_ids=batch_ids, per_story='5')),
+        'api.arch-elements': ('api', read('arch-elements')),
+        'api.bootstrap': ('api', read('bootstrap')),
+        'api.search': ('api', lambda i: api_event('GET', {'action': 'search', 'project_id': project, 'q': f'платежи {i % 50}', 'limit': '20'})),
+        'api.changes': ('api', read('changes', since='0', limit='100')),
+        'api.comments.post': ('api', lambda i: api_event('POST', {'action': 'comments', 'project_id': project}, {
+            'story_id': story_ids[i % len(story_ids)], 'author': 'bench', 'text': f'комментарий {i}'})),
+        'api.arch-elements.put': ('api', lambda i: api_event('PUT', {'action': 'arch-elements', 'project_id': project}, {
+            'elements': [{'id': element_id, 'x': (i + n) % 1000, 'y': (i * 3 + n) % 800} for n, element_id in enumerate(element_ids)]})),
+        'jarvis.miss': ('jarvis-ai', lambda i: api_event('POST', {}, {
+            'message': f'Оцени архитектуру {i} {time.perf_counter_ns()}', 'context': 'architecture', 'history': history(i)})),
+        'jarvis.hit': ('jarvis-ai', lambda i: api_event('POST', {}, {
+            'message': 'Оцени архитектуру', 'context': 'architecture', 'history': history(3)})),
+        'jarvis.stream': ('jarvis-ai', lambda i: api_event('POST', {}, {
+            'message': f'Оцени поток {i} {time.perf_counter_ns()}', 'context': 'studio', 'stream': True}))
+    }
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Перцентиль по ближайшему рангу"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def run_load(handler: Callable[..., Dict[str, Any]], factory: EventFactory, requests: int, concurrency: int) -> Dict[str, Any]:
+    """Гоняет requests вызовов в concurrency потоков и собирает латентности"""
+    counter = count()
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    cache_hits = 0
+    lock = threading.Lock()
+
+    def worker() -> None:
+        nonlocal cache_hits
+        while True:
+            i = next(counter)
+            if i >= requests:
+                return
+            event = factory(i)
+            started = time.perf_counter()
+            response = handler(event, None)
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                status = str(response['statusCode'])
+                statuses[status] = statuses.get(status, 0) + 1
+                cache_hits += response['headers'].get('X-Cache') == 'HIT'
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    errors = sum(total for status, total in statuses.items() if not status.startswith(('2', '3')))
+    return {
+        'concurrency': concurrency,
+        'requests': requests,
+        'errors': errors,
+        'statuses': statuses,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'mean_ms': round(statistics.fmean(latencies) * 1000, 3),
+        'max_ms': round(latencies[-1] * 1000, 3),
+        'throughput_rps': round(requests / wall, 1),
+        'cache_hit_ratio': round(cache_hits / requests, 3)
+    }
+
+def measure_allocations(handler: Callable[..., Dict[str, Any]], factory: EventFactory, calls: int) -> Dict[str, Any]:
+    """Средние пиковые и удержанные аллокации Python на вызов (tracemalloc)"""
+    handler(factory(0), None)
+    tracemalloc.start()
+    peaks: List[int] = []
+    retained_start = tracemalloc.get_traced_memory()[0]
+    for i in range(1, calls + 1):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        handler(factory(i), None)
+        peaks.append(tracemalloc.get_traced_memory()[1] - before)
+    retained = tracemalloc.get_traced_memory()[0] - retained_start
+    tracemalloc.stop()
+    return {
+        'calls': calls,
+        'peak_kib': round(statistics.fmean(peaks) / 1024, 1),
+        'max_peak_kib': round(max(peaks) / 1024, 1),
+        'retained_kib_per_call': round(retained / calls / 1024, 2)
+    }
+
+def compare_results(current: Dict[str, Any], baseline: Dict[str, Any]) -> None:
+    """Печатает изменение p50/p95 и пропускной способности относительно прошлого прогона"""
+    previous = {(row['scenario'], row['concurrency']): row for row in baseline['results']}
+    print(f"\n{'scenario':<26}{'conc':>5}{'p50 Δ%':>10}{'p95 Δ%':>10}{'rps Δ%':>10}")
+    for row in current['results']:
+        old = previous.get((row['scenario'], row['concurrency']))
+        if old is None:
+            continue
+        deltas = [
+            (row[field] - old[field]) / old[field] * 100 if old[field] else 0.0
+            for field in ('p50_ms', 'p95_ms', 'throughput_rps')
+        ]
+        print(f"{row['scenario']:<26}{row['concurrency']:>5}" + ''.join(f'{delta:>+10.1f}' for delta in deltas))
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Бенчмарк функций api и jarvis-ai')
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL'), help='DSN локального Postgres с примененными миграциями')
+    parser.add_argument('--stories', type=int, default=2000, help='историй в сгенерированном проекте')
+    parser.add_argument('--comments-per-story', type=int, default=3)
+    parser.add_argument('--okrs', type=int, default=20)
+    parser.add_argument('--elements', type=int, default=200, help='архитектурных элементов')
+    parser.add_argument('--requests', type=int, default=200, help='вызовов на сценарий и уровень параллельности')
+    parser.add_argument('--concurrency', default='1,8', help='уровни параллельности через запятую')
+    parser.add_argument('--openai-latency-ms', type=float, default=50, help='задержка фейкового OpenAI')
+    parser.add_argument('--alloc-calls', type=int, default=20, help='вызовов под tracemalloc на сценарий (0 - не мерить)')
+    parser.add_argument('--scenarios', default='', help='префиксы сценариев через запятую, например api.stories,jarvis')
+    parser.add_argument('--no-response-cache', action='store_true', help='отключить кэш ответов в обеих функциях')
+    parser.add_argument('--keep-data', action='store_true', help='не удалять проект бенчмарка после прогона')
+    parser.add_argument('--output', default='bench_results.json', help='куда сохранить результаты (JSON)')
+    parser.add_argument('--compare', help='JSON прошлого прогона для сравнения')
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    if not args.database_url:
+        print('DATABASE_URL or --database-url is required', file=sys.stderr)
+        return 2
+
+    server, openai_url = start_fake_openai(args.openai_latency_ms)
+    os.environ['DATABASE_URL'] = args.database_url
+    os.environ['OPENAI_API_URL'] = openai_url
+    os.environ['OPENAI_API_KEY'] = 'bench'
+    if args.no_response_cache:
+        os.environ['RESPONSE_CACHE_TTL'] = '0'
+        os.environ['JARVIS_CACHE_TTL'] = '0'
+    functions = {name: load_function(name) for name in ('api', 'jarvis-ai')}
+
+    seed_started = time.perf_counter()
+    seed = seed_project(args.database_url, args.stories, args.comments_per_story, args.okrs, args.elements)
+    seed_seconds = time.perf_counter() - seed_started
+    prefixes = [prefix.strip() for prefix in args.scenarios.split(',') if prefix.strip()]
+    scenarios = {
+        name: scenario for name, scenario in build_scenarios(seed).items()
+        if not prefixes or name.startswith(tuple(prefixes))
+    }
+    levels = [int(level) for level in args.concurrency.split(',')]
+
+    results: List[Dict[str, Any]] = []
+    allocations: Dict[str, Any] = {}
+    try:
+        for name, (function, factory) in scenarios.items():
+            handler = functions[function].handler
+            for level in levels:
+                row = dict(scenario=name, **run_load(handler, factory, args.requests, level))
+                results.append(row)
+                print(f"{name:<26}c={level:<4}p50={row['p50_ms']:>9.2f}ms p95={row['p95_ms']:>9.2f}ms "
+                      f"p99={row['p99_ms']:>9.2f}ms {row['throughput_rps']:>8.1f} rps errors={row['errors']}")
+            if args.alloc_calls:
+                allocations[name] = measure_allocations(handler, factory, args.alloc_calls)
+                print(f"{name:<26}alloc peak={allocations[name]['peak_kib']} KiB retained/call={allocations[name]['retained_kib_per_call']} KiB")
+    finally:
+        server.shutdown()
+        if not args.keep_data:
+            drop_project(args.database_url, seed['project_id'])
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'postgres': seed['server_version'],
+            'seed': {
+                'stories': args.stories, 'comments_per_story': args.comments_per_story,
+                'okrs': args.okrs, 'elements': args.elements, 'seconds': round(seed_seconds, 2)
+            },
+            'requests': args.requests,
+            'openai_latency_ms': args.openai_latency_ms,
+            'response_cache': not args.no_response_cache,
+            'env': {key: os.environ[key] for key in ('DB_POOL_MAX_SIZE', 'JSON_MODE', 'METRICS_ENABLED') if key in os.environ}
+        },
+        'results': results,
+        'allocations': allocations,
+        'api_pool': functions['api'].get_pool_stats()
+    }
+    with open(args.output, 'w', encoding='utf-8') as output:
+        json.dump(report, output, ensure_ascii=False, indent=2)
+    print(f'\nSaved {args.output}')
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as baseline:
+            compare_results(report, json.load(baseline))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,11 +1,228 @@
+import hashlib
 import json
 import os
-from typing import Dict, Any
+import random
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Callable, Dict, Any, Iterable, Iterator, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+OPENAI_API_URL = os.environ.get('OPENAI_API_URL', 'https://api.openai.com/v1/chat/completions')
+OPENAI_CONNECT_TIMEOUT = float(os.environ.get('OPENAI_CONNECT_TIMEOUT', '2'))
+OPENAI_READ_TIMEOUT = float(os.environ.get('OPENAI_READ_TIMEOUT', '5'))
+OPENAI_TIME_BUDGET = float(os.environ.get('OPENAI_TIME_BUDGET', '6'))
+OPENAI_MAX_RETRIES = int(os.environ.get('OPENAI_MAX_RETRIES', '2'))
+OPENAI_RETRY_BACKOFF = float(os.environ.get('OPENAI_RETRY_BACKOFF', '0.2'))
+OPENAI_POOL_SIZE = int(os.environ.get('OPENAI_POOL_SIZE', '4'))
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+def create_http_session() -> requests.Session:
+    """Создает сессию с пулом keep-alive соединений к OpenAI"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=OPENAI_POOL_SIZE, max_retries=0)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+http_session = create_http_session()
+
+def retry_delay(attempt: int, response: Optional[requests.Response]) -> float:
+    """Пауза перед повтором: Retry-After или экспоненциальный backoff с полным jitter"""
+    if response is not None:
+        retry_after = response.headers.get('Retry-After')
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+    return random.uniform(0, OPENAI_RETRY_BACKOFF * (2 ** attempt))
+
+def post_chat_completion(openai_key: str, payload: Dict[str, Any], stream: bool = False) -> requests.Response:
+    """Вызывает chat/completions с ограниченными повторами на 429/5xx в пределах бюджета времени"""
+    deadline = time.monotonic() + OPENAI_TIME_BUDGET
+    attempt = 0
+    while True:
+        remaining = deadline - time.monotonic()
+        response = None
+        try:
+            response = http_session.post(
+                OPENAI_API_URL,
+                headers={
+                    'Authorization': f'Bearer {openai_key}',
+                    'Content-Type': 'application/json'
+                },
+                json=payload,
+                stream=stream,
+                timeout=(min(OPENAI_CONNECT_TIMEOUT, remaining), max(min(OPENAI_READ_TIMEOUT, remaining), 0.1))
+            )
+            if response.status_code not in RETRYABLE_STATUSES:
+                return response
+        except requests.ConnectionError:
+            if attempt >= OPENAI_MAX_RETRIES:
+                raise
+        
+        if attempt >= OPENAI_MAX_RETRIES:
+            return response
+        delay = retry_delay(attempt, response)
+        if time.monotonic() + delay + OPENAI_CONNECT_TIMEOUT >= deadline:
+            if response is None:
+                raise requests.ConnectionError('OpenAI API unreachable within time budget')
+            return response
+        if response is not None:
+            response.close()
+        time.sleep(delay)
+        attempt += 1
+
+def iter_completion_deltas(response: requests.Response) -> Iterator[str]:
+    """Разбирает потоковый ответ chat/completions (SSE) и отдает фрагменты текста"""
+    try:
+        for raw_line in response.iter_lines():
+            line = raw_line.decode('utf-8').strip()
+            if not line.startswith('data:'):
+                continue
+            data = line[len('data:'):].strip()
+            if data == '[DONE]':
+                break
+            choices = json.loads(data).get('choices') or []
+            delta = choices[0].get('delta', {}).get('content') if choices else None
+            if delta:
+                yield delta
+    finally:
+        response.close()
+
+def sse_event(payload: Dict[str, Any], event: Optional[str] = None) -> str:
+    """Одно событие server-sent events"""
+    prefix = f'event: {event}\n' if event else ''
+    return f'{prefix}data: {json.dumps(payload, ensure_ascii=False)}\n\n'
+
+def stream_events(deltas: Iterable[str], context_type: str, on_complete: Callable[[str], None]) -> Iterator[str]:
+    """События delta по мере генерации и финальное done с полным ответом и метаданными"""
+    parts: List[str] = []
+    for delta in deltas:
+        parts.append(delta)
+        yield sse_event({'delta': delta})
+    answer = ''.join(parts).strip()
+    on_complete(answer)
+    yield sse_event({'response': answer, 'context': context_type, 'model': 'gpt-4o-mini'}, event='done')
+
+def sse_response(events: Iterable[str], cache_status: str) -> Dict[str, Any]:
+    """Ответ функции с телом text/event-stream"""
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'text/event-stream; charset=utf-8',
+            'Cache-Control': 'no-cache',
+            'Access-Control-Allow-Origin': '*',
+            'X-Cache': cache_status
+        },
+        'body': ''.join(events),
+        'isBase64Encoded': False
+    }
+
+HISTORY_TOKEN_BUDGET = int(os.environ.get('JARVIS_HISTORY_TOKEN_BUDGET', '600'))
+HISTORY_MAX_TURNS = int(os.environ.get('JARVIS_HISTORY_MAX_TURNS', '20'))
+MESSAGE_TOKEN_OVERHEAD = 4
+MIN_TRUNCATED_TOKENS = 16
+
+@lru_cache(maxsize=2048)
+def estimate_tokens(text: str) -> int:
+    """Оценивает число токенов: ~4 латинских символа или ~2 кириллических на токен"""
+    wide_chars = len(text.encode('utf-8')) - len(text)
+    return (len(text) - wide_chars) // 4 + wide_chars // 2 + 1
+
+def truncate_to_tokens(text: str, tokens: int) -> str:
+    """Оставляет конец реплики, укладывающийся в заданное число токенов"""
+    keep = max(1, len(text) * tokens // estimate_tokens(text) - 1)
+    return '…' + text[-keep:]
+
+def pack_history(history: Any, budget: int = HISTORY_TOKEN_BUDGET) -> List[Dict[str, str]]:
+    """Собирает последние реплики истории в пределах бюджета токенов"""
+    if not isinstance(history, list):
+        return []
+    packed = []
+    remaining = budget
+    for msg in reversed(history[-HISTORY_MAX_TURNS:]):
+        if not isinstance(msg, dict):
+            continue
+        role = 'user' if msg.get('role') == 'user' else 'assistant'
+        content = str(msg.get('content', ''))
+        cost = estimate_tokens(content) + MESSAGE_TOKEN_OVERHEAD
+        if cost <= remaining:
+            packed.append({'role': role, 'content': content})
+            remaining -= cost
+            continue
+        if remaining - MESSAGE_TOKEN_OVERHEAD >= MIN_TRUNCATED_TOKENS:
+            packed.append({'role': role, 'content': truncate_to_tokens(content, remaining - MESSAGE_TOKEN_OVERHEAD)})
+        break
+    packed.reverse()
+    return packed
+
+RESPONSE_CACHE_TTL = float(os.environ.get('JARVIS_CACHE_TTL', '3600'))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get('JARVIS_CACHE_MAX_ENTRIES', '512'))
+
+_response_cache: 'OrderedDict[str, Tuple[float, str]]' = OrderedDict()
+_cache_lock = threading.Lock()
+_cache_stats: Dict[str, int] = {'hits': 0, 'misses': 0, 'bypasses': 0, 'evictions': 0, 'expirations': 0}
+
+def normalize_text(text: str) -> str:
+    """Нормализует текст для ключа кэша: пробелы и регистр"""
+    return ' '.join(str(text).split()).casefold()
+
+def make_cache_key(prompt_id: str, history: List[Dict[str, str]], message: str) -> str:
+    """Ключ кэша из промпта, упакованной истории и сообщения"""
+    turns = [(msg['role'], normalize_text(msg['content'])) for msg in history]
+    raw = json.dumps([prompt_id, turns, normalize_text(message)], ensure_ascii=False)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+def cache_get(key: str) -> Optional[str]:
+    """Возвращает сохраненный ответ, если он не устарел"""
+    with _cache_lock:
+        entry = _response_cache.get(key)
+        if entry is None:
+            _cache_stats['misses'] += 1
+            return None
+        expires_at, answer = entry
+        if expires_at <= time.monotonic():
+            del _response_cache[key]
+            _cache_stats['expirations'] += 1
+            _cache_stats['misses'] += 1
+            return None
+        _response_cache.move_to_end(key)
+        _cache_stats['hits'] += 1
+        return answer
+
+def cache_put(key: str, answer: str) -> None:
+    """Сохраняет ответ, вытесняя самые старые записи"""
+    with _cache_lock:
+        _response_cache[key] = (time.monotonic() + RESPONSE_CACHE_TTL, answer)
+        _response_cache.move_to_end(key)
+        while len(_response_cache) > RESPONSE_CACHE_MAX_ENTRIES:
+            _response_cache.popitem(last=False)
+            _cache_stats['evictions'] += 1
+
+def get_cache_stats() -> Dict[str, Any]:
+    """Счетчики кэша ответов и доля попаданий"""
+    with _cache_lock:
+        lookups = _cache_stats['hits'] + _cache_stats['misses']
+        return dict(
+            _cache_stats,
+            size=len(_response_cache),
+            max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+            hit_rate=_cache_stats['hits'] / lookups if lookups else 0.0
+        )
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
     Джарвис AI - интеллектуальный ассистент на базе OpenAI GPT-4
     Обрабатывает голосовой ввод и дает экспертные архитектурные советы
+    
+    POST / {message, context, history, cache?: 'bypass'} - ответ Джарвиса (повторные вопросы отдаются из кэша)
+    POST / {..., stream: true} - ответ в формате text/event-stream: события delta и финальное done
+    GET /?action=cache-stats - счетчики кэша ответов
     """
     method: str = event.get('httpMethod', 'POST')
     
@@ -14,7 +231,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'statusCode': 200,
             'headers': {
                 'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'POST, OPTIONS',
+                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
                 'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Session-Id',
                 'Access-Control-Max-Age': '86400'
             },
@@ -22,6 +239,15 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
+    params = event.get('queryStringParameters') or {}
+    if method == 'GET' and params.get('action') == 'cache-stats':
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps(get_cache_stats()),
+            'isBase64Encoded': False
+        }
+    
     if method != 'POST':
         return {
             'statusCode': 405,
@@ -44,8 +270,6 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'isBase64Encoded': False
             }
         
-        import requests
-        
         openai_key = os.environ.get('OPENAI_API_KEY')
         if not openai_key:
             return {
@@ -95,36 +319,52 @@ Rate limiting? "Без него через неделю ваш сервер по
 1-2 предложения. Придирки с дозой сарказма."""
         }
         
-        system_prompt = system_prompts.get(context_type, system_prompts['general'])
+        prompt_id = context_type if context_type in system_prompts else 'general'
+        system_prompt = system_prompts[prompt_id]
+        
+        stream_mode = bool(body_data.get('stream'))
+        history_messages = pack_history(conversation_history)
+        cache_key = make_cache_key(prompt_id, history_messages, user_message)
+        cache_status = 'BYPASS'
+        if body_data.get('cache') == 'bypass':
+            with _cache_lock:
+                _cache_stats['bypasses'] += 1
+        else:
+            cached_answer = cache_get(cache_key)
+            cache_status = 'MISS'
+            if cached_answer is not None and stream_mode:
+                return sse_response(stream_events([cached_answer], context_type, lambda answer: None), 'HIT')
+            if cached_answer is not None:
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', 'X-Cache': 'HIT'},
+                    'body': json.dumps({
+                        'response': cached_answer,
+                        'context': context_type,
+                        'model': 'gpt-4o-mini'
+                    }),
+                    'isBase64Encoded': False
+                }
         
         messages = [
             {'role': 'system', 'content': system_prompt}
         ]
-        
-        for msg in conversation_history[-5:]:
-            messages.append({
-                'role': 'user' if msg['role'] == 'user' else 'assistant',
-                'content': msg['content']
-            })
+        messages.extend(history_messages)
         
         messages.append({'role': 'user', 'content': user_message})
         
-        response = requests.post(
-            'https://api.openai.com/v1/chat/completions',
-            headers={
-                'Authorization': f'Bearer {openai_key}',
-                'Content-Type': 'application/json'
-            },
-            json={
-                'model': 'gpt-4o-mini',
-                'messages': messages,
-                'temperature': 0.9,
-                'max_tokens': 100,
-                'presence_penalty': 0.7,
-                'frequency_penalty': 0.4
-            },
-            timeout=5
-        )
+        payload = {
+            'model': 'gpt-4o-mini',
+            'messages': messages,
+            'temperature': 0.9,
+            'max_tokens': 100,
+            'presence_penalty': 0.7,
+            'frequency_penalty': 0.4
+        }
+        if stream_mode:
+            payload['stream'] = True
+        
+        response = post_chat_completion(openai_key, payload, stream=stream_mode)
         
         if response.status_code != 200:
             return {
@@ -134,12 +374,17 @@ Rate limiting? "Без него через неделю ваш сервер по
                 'isBase64Encoded': False
             }
         
+        if stream_mode:
+            events = stream_events(iter_completion_deltas(response), context_type, lambda answer: cache_put(cache_key, answer))
+            return sse_response(events, cache_status)
+        
         result = response.json()
         ai_response = result['choices'][0]['message']['content'].strip()
+        cache_put(cache_key, ai_response)
         
         return {
             'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', 'X-Cache': cache_status},
             'body': json.dumps({
                 'response': ai_response,
                 'context': context_type,
@@ -0,0 +1,3 @@
+-- Track client-side timestamp of the last accepted position update
+ALTER TABLE architecture_elements
+ADD COLUMN position_client_ts TIMESTAMP;
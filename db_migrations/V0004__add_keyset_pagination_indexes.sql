@@ -0,0 +1,6 @@
+-- Composite indexes for keyset pagination on (created_at, id)
+CREATE INDEX IF NOT EXISTS idx_user_stories_project_created_id
+    ON user_stories (project_id, created_at, id);
+
+CREATE INDEX IF NOT EXISTS idx_comments_story_created_id
+    ON comments (story_id, created_at, id);
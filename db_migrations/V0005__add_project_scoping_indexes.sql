@@ -0,0 +1,9 @@
+-- Indexes for per-project queries (user_stories is covered by idx_user_stories_project_created_id)
+CREATE INDEX IF NOT EXISTS idx_project_okrs_project_created
+    ON project_okrs (project_id, created_at);
+
+CREATE INDEX IF NOT EXISTS idx_architecture_elements_project_canvas
+    ON architecture_elements (project_id, canvas_type, id);
+
+CREATE INDEX IF NOT EXISTS idx_acceptance_criteria_story
+    ON acceptance_criteria (story_id);
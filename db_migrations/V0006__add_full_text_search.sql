@@ -0,0 +1,27 @@
+-- Full-text search vectors: russian stems plus simple (exact) lexemes for names, codes and latin terms
+ALTER TABLE user_stories
+ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+    setweight(to_tsvector('russian', action) || to_tsvector('simple', action), 'A') ||
+    setweight(to_tsvector('russian', benefit) || to_tsvector('simple', benefit), 'B') ||
+    setweight(to_tsvector('russian', role || ' ' || coalesce(epic, '')) || to_tsvector('simple', role || ' ' || coalesce(epic, '')), 'C')
+) STORED;
+
+ALTER TABLE comments
+ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+    to_tsvector('russian', text) || to_tsvector('simple', text)
+) STORED;
+
+ALTER TABLE project_okrs
+ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+    setweight(to_tsvector('russian', objective) || to_tsvector('simple', objective), 'A') ||
+    setweight(to_tsvector('russian', key_results) || to_tsvector('simple', key_results), 'B')
+) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_user_stories_search
+    ON user_stories USING GIN (search_vector);
+
+CREATE INDEX IF NOT EXISTS idx_comments_search
+    ON comments USING GIN (search_vector);
+
+CREATE INDEX IF NOT EXISTS idx_project_okrs_search
+    ON project_okrs USING GIN (search_vector);
@@ -0,0 +1,13 @@
+-- Change feed: one row per written entity, seq grows monotonically within a project
+CREATE TABLE IF NOT EXISTS change_log (
+    seq BIGSERIAL PRIMARY KEY,
+    project_id INTEGER NOT NULL REFERENCES projects(id),
+    entity VARCHAR(50) NOT NULL,
+    entity_id INTEGER NOT NULL,
+    operation VARCHAR(10) NOT NULL,
+    payload JSONB,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_change_log_project_seq
+    ON change_log (project_id, seq);
@@ -310,7 +310,7 @@ export default function Index() {
       await fetch(`${API_URL}?action=arch-elements`, {
         method: 'PUT',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ id, x, y }),
+        body: JSON.stringify({ id, x, y, client_ts: Date.now() }),
       });
     } catch (error) {
       console.error('Error saving position:', error);